@@ -1,270 +1,405 @@
-from queue import Queue
-from typing import Iterable, List
-from itertools import combinations
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, Iterator, List
+from itertools import chain, combinations
+import numpy as np
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, run the kernel as plain Python
 
-def powerset(iter: Iterable) -> 'set[tuple]':
+    def njit(*args, **kwargs):
+        return lambda f: f
+
+BLANK = 0  # Internal value of a blank space; digits are stored offset past it
+
+if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+    popcount = np.bitwise_count
+else:
+    _POPCOUNT_LUT = np.array([bin(i).count('1') for i in range(1 << 16)],
+                             dtype=np.uint8)
+
+    def popcount(x):
+        '''
+        Returns the number of set bits in each element of 'x'.
+        '''
+        x = np.asarray(x, dtype=np.uint32)
+        return _POPCOUNT_LUT[x & 0xFFFF] + _POPCOUNT_LUT[x >> 16]
+
+
+def bits(mask) -> List[int]:
+    '''
+    Returns the values (1-based bit positions) set in bitmask 'mask', ascending.
+    '''
+    mask = int(mask)
+    return [i + 1 for i in range(mask.bit_length()) if mask >> i & 1]
+
+
+def powerset(it: Iterable, max_k: int = None) -> 'Iterator[tuple]':
+    '''
+    Yields all subsets 's' of iterable 'it' as tuples where 2 <= #s <= max_k.
+    '''
+    it = tuple(it)
+    if max_k is None or max_k > len(it):
+        max_k = len(it)
+    return chain.from_iterable(
+        combinations(it, r) for r in range(2, max_k + 1))
+
+
+@lru_cache(maxsize=None)
+def subsets(size: int, max_k: int) -> 'tuple[tuple]':
+    '''
+    Returns powerset(range(size), max_k) as a tuple.
+
+    Subsets are positions into a list of 'size' items rather than the items
+    themselves, so the result can be reused for any list of that length.
+    '''
+    return tuple(powerset(range(size), max_k))
+
+
+@lru_cache(maxsize=None)
+def layout(n: int) -> 'tuple[np.ndarray, np.ndarray]':
+    '''
+    Returns the (groups, peers) index arrays for a board with n x n blocks.
+
+    groups holds the space indices of every block, row, then col.
+    peers[i] holds the indices of every space sharing a group with space i.
+    Both depend only on n, so they are built once and shared between boards.
+    '''
+    # Block, row, col of each space
+    bhv = [((i // n % n) + n * (i // ((n**2) * n)), i // (n**2), i % (n**2))
+           for i in range(n**4)]
+    blocks = [[] for _ in range(n**2)]
+    rows = [[] for _ in range(n**2)]
+    cols = [[] for _ in range(n**2)]
+    for i, (b, h, v) in enumerate(bhv):
+        blocks[b].append(i)
+        rows[h].append(i)
+        cols[v].append(i)
+    groups = np.array(blocks + rows + cols, dtype=np.intp)
+    peers = np.array([
+        sorted(set(blocks[b] + rows[h] + cols[v]) - {i})
+        for i, (b, h, v) in enumerate(bhv)
+    ], dtype=np.intp)
+    # Shared between boards, so freeze them
+    groups.setflags(write=False)
+    peers.setflags(write=False)
+    return groups, peers
+
+
+@lru_cache(maxsize=None)
+def layout_lists(n: int) -> 'tuple[tuple[int]]':
     '''
-    Returns all subsets 's' of iterable 'iter' as a set of tuples where #s >= 2.
+    Returns the groups from layout(n) as nested tuples of ints.
     '''
-    comb = set([combinations(iter, i) for i in range(2, len(iter) + 1)])
-    p_set = set()
-    for c in comb:
-        for s in c:
-            p_set.add(s)
-    return p_set
+    return tuple(tuple(g) for g in layout(n)[0].tolist())
+
+
+@njit(cache=True)
+def propagate(values, candidates, peers, queue, queued, count):
+    '''
+    Constraint propagation kernel for Sudoku.constraint_solve.
+
+    'queue' is a ring buffer (one slot per space) holding 'count' pending
+    space indices from its start, and 'queued' flags which spaces are in it.
+    Runs until the queue is empty, updating values and candidates in place.
+
+    Returns the number of spaces given a value, and whether a space was left
+    with no constraints (a conflict).  Stops early on a conflict.
+    '''
+    size = len(queue)
+    head = 0
+    changes = 0
+    while count > 0:
+        i = queue[head]
+        head = (head + 1) % size
+        count -= 1
+        queued[i] = False
+        value = values[i]
+        if value == BLANK:
+            futures = candidates[i]
+            if futures == 0:
+                return changes, True
+            # Still more than one constraint, nothing to push
+            if futures & (futures - 1) != 0:
+                continue
+            # Only one constraint, set my value
+            value = 1
+            while futures > 1:
+                futures >>= 1
+                value += 1
+            values[i] = value
+            candidates[i] = 0
+            changes += 1
+        # Remove my value from neighbor constraints
+        bit = 1 << (value - 1)
+        for p in peers[i]:
+            old = candidates[p]
+            if old & bit:
+                new = old ^ bit
+                candidates[p] = new
+                if new == 0:
+                    return changes, True
+                # Only one constraint, queue neighbor to take its value
+                if new & (new - 1) == 0 and not queued[p]:
+                    queued[p] = True
+                    queue[(head + count) % size] = p
+                    count += 1
+    return changes, False
 
 
 class UniqueQueue():
     '''
-    Queue wrapper.
+    FIFO queue of Space indices.
 
-    Maintains a set of current items in Queue to prevent duplicates from being added.
+    Maintains a bitmask of current items in queue to prevent duplicates from
+    being added.
     '''
     def __init__(self) -> None:
-        self.que: Queue = Queue()
-        self.set: set = set()
+        self.que: deque = deque()
+        self.inq: int = 0
 
-    def put(self, item):
-        if item not in self.set:
-            self.set.add(item)
-            self.que.put(item)
+    def put(self, item: int):
+        if not self.inq >> item & 1:
+            self.inq |= 1 << item
+            self.que.append(item)
 
     def get(self):
-        if not self.empty():
-            item = self.que.get()
-            self.set.remove(item)
+        if self.que:
+            item = self.que.popleft()
+            self.inq &= ~(1 << item)
             return item
         return None
 
-    def empty(self):
-        return self.que.qsize() == 0
-
-
-class Space:
-    '''
-    Contains a value (None or int), constraints, and neighbors.
-    '''
-    def __init__(self, value=None, n=3) -> None:
-        self.value = value
-        self.n = n
-        if value is not None:
-            self.futures = []
-        else:
-            self.futures = [*range(1, n**2 + 1)]
-        self.neighbors: set = set()
+    def clear(self):
+        self.que.clear()
+        self.inq = 0
 
-    def set_groups(self, groups):
-        for g in groups:
-            self.neighbors.update(g)
-        self.neighbors.remove(self)
+    def empty(self):
+        return not self.que
 
 
 class Sudoku:
     '''
     Sudoku board and solver logic.
+
+    Board state is stored as parallel arrays indexed by cell:
+    values[i] (BLANK, or the digit's position 1..n^2 in the board's digit
+    range) and candidates[i] (bitmask, bit v-1 set if v is still possible).
+    peers[i] holds the indices of every cell sharing a row/col/block with
+    cell i.
+
+    Digits run from 'low' to low + n^2 - 1.  'low' defaults to 0 on 16x16
+    boards (hex '0'-'F') and 1 otherwise.
     '''
     stats = {'cycles': 0, 'recurse': 0}
 
     def reset_stats() -> None:
         Sudoku.stats = {'cycles': 0, 'recurse': 0}
 
-    def __init__(self, starting_layout, n) -> None:
+    def __init__(self, starting_layout, n, low=None) -> None:
+        # One candidate bit per digit in a uint32
+        if not 1 <= n <= 5:
+            raise ValueError(f'Unsupported block size n={n} (must be 1-5)')
         self.mod_q: UniqueQueue = UniqueQueue()
-        self.spaces: 'dict[Space]' = {}
-        self.blocks = {}
-        self.rows = {}
-        self.cols = {}
-        # Create set for each row, col, block
-        for i in range(n**2):
-            self.blocks[i] = set()
-            self.rows[i] = set()
-            self.cols[i] = set()
-        # Create spaces and add to groups
+        # Lowest digit on the board
+        if low is None:
+            low = 0 if n == 4 else 1
+        self.low = low
+        self.values: np.ndarray = np.array([
+            BLANK if v is None else v - self.low + 1 for v in starting_layout
+        ], dtype=np.int64)
+        if np.any((self.values < 0) | (self.values > n**2)):
+            raise ValueError(f'Given digits out of range for n={n}')
+        self.values = self.values.astype(np.uint32)
+        self.candidates: np.ndarray = np.where(self.values == BLANK,
+                                               (1 << n**2) - 1,
+                                               0).astype(np.uint32)
+        # Givens must never change
+        self.givens: np.ndarray = self.values != BLANK
+        self.given_values: np.ndarray = self.values[self.givens]
+        self.groups, self.peers = layout(n)
+        # Work buffers for propagate(); queued is all False between calls
+        self.queue: np.ndarray = np.zeros(n**4, dtype=np.intp)
+        self.queued: np.ndarray = np.zeros(n**4, dtype=np.bool_)
         for i in range(n**4):
-            s: Space = Space(starting_layout[i], n)
-            b = (i // n % n) + n * (i // ((n**2) * n))
-            h = i // (n**2)
-            v = i % (n**2)
-            self.blocks[b].add(s)
-            self.rows[h].add(s)
-            self.cols[v].add(s)
-            self.spaces[i] = s
-            self.mod_q.put(s)  # Mark Space as modified
-        # Link Spaces with their neighbors
-        for i in range(n**4):
-            b = (i // n % n) + n * (i // ((n**2) * n))
-            h = i // (n**2)
-            v = i % (n**2)
-            self.spaces[i].set_groups([
-                self.blocks[b],
-                self.rows[h],
-                self.cols[v],
-            ])
+            self.mod_q.put(i)  # Mark Space as modified
         self.n = n
         self.states = set()
         self.depth = 0
-        self.iter_wide = 0
+        self.change_counter = 0  # Number of spaces given a value so far
+        self.conflict = self.has_conflict()  # Kept up to date while solving
 
     def solve(self) -> None:
         '''
         Solves the Sudoku puzzle.
         '''
         # Loop through naive constraint search and naked set search
-        while not self.is_solved() and not self.has_conflict():
-            start_state = self.get_state()
+        while not self.is_solved() and not self.conflict:
+            start_changes = self.change_counter
             self.constraint_solve()
-            self.update_naked_sets()
-            # Did we win?
-            if self.get_state() == start_state and self.mod_q.empty():
+            # Only move on to costlier searches once constraint search is stuck
+            if self.change_counter == start_changes:
+                self.hidden_singles()
+                if self.mod_q.empty():
+                    self.update_naked_sets()
+            # Stuck once no space got a value and none was narrowed
+            if self.change_counter == start_changes and self.mod_q.empty():
                 break
             Sudoku.stats['cycles'] += 1
+        assert self.conflict == self.has_conflict()
         # If stuck, begin recursive backtrace
-        if not self.is_solved() and not self.has_conflict():
+        if not self.is_solved() and not self.conflict:
             if self.depth == 0:  # Root
                 self.states.clear()
-                # Start with Spaces containing 2 future (constraint) values, then increase
-                for i in range(2, self.n**2):
-                    self.spaces = self.recursive_backtrack(i)
-            else:  # Non-root
-                self.spaces = self.recursive_backtrack(self.iter_wide)
+            self.recursive_backtrack()
 
-    def recursive_backtrack(self, i) -> 'set[Space]':
+    def recursive_backtrack(self) -> None:
         '''
-        Creates a new game instance, makes a move,
-        then attempts to solve to see if the move was correct.
+        Picks the unknown space with the fewest constraints (MRV), then for each
+        of its constraints makes the move on this board and attempts to solve
+        to see if the move was correct.
 
-        Returns the set of spaces for the solved board if the move was correct.
-        Otherwise, removes the move from the respective Space's constraints and
-        returns the current set of spaces (no change).
+        If a move was correct, the board is left solved.  Otherwise, the board
+        is restored to its state before the move and the failed move is
+        removed from the space's constraints.
         '''
-        s: Space
-        for k, s in self.spaces.items():
-            if 2 <= len(s.futures) <= i:
-                for j in range(len(s.futures) - 1, 0, -1):
-                    Sudoku.stats['recurse'] += 1
-                    new_state = self.get_state()
-                    new_state[k] = s.futures[j]
-                    if str(new_state) not in self.states:
-                        self.states.add(str(new_state))
-                        new_game: Sudoku = Sudoku(new_state, self.n)
-                        new_game.states = self.states
-                        new_game.depth = self.depth + 1
-                        new_game.iter_wide = i
-                        new_game.solve()
-                        if new_game.is_solved():
-                            return new_game.spaces
-                        else:
-                            s.futures.remove(s.futures[j])
-                            if len(s.futures) == 1:
-                                s.value = s.futures[0]
-                                s.futures = []
-                                break
-        return self.spaces
+        # Unknown space with the fewest constraints; known spaces never win
+        k = int(np.argmin(
+            np.where(self.values == BLANK, popcount(self.candidates), 255)))
+        for future in bits(self.candidates[k]):
+            Sudoku.stats['recurse'] += 1
+            saved = (self.values.copy(), self.candidates.copy())
+            self.values[k] = future
+            self.candidates[k] = 0
+            key = self.values.tobytes()
+            if key not in self.states:
+                self.states.add(key)
+                self.mod_q.put(k)
+                self.depth += 1
+                self.solve()
+                self.depth -= 1
+                if self.is_solved():
+                    return
+                self.mod_q.clear()
+            self.values, self.candidates = saved
+            self.candidates[k] &= ~np.uint32(1 << (future - 1))
+            # Conflict if that was the space's last constraint
+            self.conflict = bool(self.candidates[k] == 0)
 
     def constraint_solve(self) -> None:
         '''
-        Update's each space's value and/or constraints based on the values of
-        it's neighbors (spaces in the same row/col/block).  Each space also updates
-        its neighbors values.
+        Removes each known space's value from the constraints of its neighbors
+        (spaces in the same row/col/block).  A space left with a single
+        constraint takes that value.
 
-        When a space is changed in any way (value or constraints), it is placed onto
+        When a space is narrowed to a single constraint, it is placed onto
         the modified queue.  Function loops until queue is empty.
         '''
+        count = 0
         while not self.mod_q.empty():
-            curr_space: Space = self.mod_q.get()
-            # Only one constraint, set my value
-            if len(curr_space.futures) == 1:
-                curr_space.value = curr_space.futures[0]
-                curr_space.futures = []
-            n: Space
-            for n in curr_space.neighbors:
-                # Remove neighbor values from my constraints
-                if n.value in curr_space.futures:
-                    curr_space.futures.remove(n.value)
-                    self.mod_q.put(curr_space)
-                # Remove my value from neighbor constraints
-                if curr_space.value in n.futures:
-                    n.futures.remove(curr_space.value)
-                    self.mod_q.put(n)
-                # Only one constraint, set neighbor value
-                if len(n.futures) == 1:
-                    n.value = n.futures[0]
-                    n.futures = []
-                    self.mod_q.put(n)
+            i = self.mod_q.get()
+            self.queue[count] = i
+            self.queued[i] = True
+            count += 1
+        changes, self.conflict = propagate(self.values, self.candidates,
+                                           self.peers, self.queue,
+                                           self.queued, count)
+        self.change_counter += changes
+        if self.conflict:
+            self.queued[:] = False
+
+    def hidden_singles(self) -> None:
+        '''
+        Finds values that only one space in a group can still take and
+        narrows that space's constraints to the value.
+        '''
+        futures = np.uint32(1) << np.arange(self.n**2, dtype=np.uint32)
+        # has[g, s, f]: space s of group g can take value f + 1
+        has = (self.candidates[self.groups][:, :, None] & futures) != 0
+        for g, f in zip(*np.nonzero(has.sum(axis=1) == 1)):
+            i = self.groups[g][has[g, :, f]][0]
+            if self.candidates[i] != futures[f]:
+                self.candidates[i] &= futures[f]
+                self.mod_q.put(int(i))
+                # Space also had to take another hidden single
+                if self.candidates[i] == 0:
+                    self.conflict = True
+                    return
 
     def update_naked_sets(self) -> None:
         '''
         Finds all naked sets and updates inverse set constraints.
         '''
-        groups = []
-        # Populate list of every group on board
-        for i in range(self.n**2):
-            groups.extend([self.blocks[i], self.rows[i], self.cols[i]])
-        for g in groups:
-            unk_s: List[Space] = []
-            s: Space
+        # Plain lists index much faster than numpy arrays one item at a time
+        values = self.values.tolist()
+        candidates = self.candidates.tolist()
+        max_k = self.n + 1  # Up to quads on 9x9
+        for g in layout_lists(self.n):
             # Populate unknown set with blank spaces in group
-            for s in g:
-                if s.value is None:
-                    unk_s.append(s)
-            if len(unk_s) > 0:
-                # check every subset of unknown set
-                p_set = powerset(unk_s)
-                for subset in p_set:
-                    set_nums: set = set()
-                    # Get all constraint values for subset
-                    for s in subset:
-                        set_nums.update(s.futures)
-                    # If #subset == #constraints then subset is naked set
-                    # Remove constraints from inverse set members' futures
-                    if len(set_nums) == len(subset) < len(unk_s):
-                        for s in unk_s:
-                            if s not in subset:
-                                for n in set_nums:
-                                    if n in s.futures:
-                                        s.futures.remove(n)
-                                        self.mod_q.put(s)
+            unk_s: List[int] = [i for i in g if values[i] == BLANK]
+            # Spaces with more constraints than the largest subset can never
+            # be part of a naked set, so leave them out of the search
+            small: List[int] = [
+                i for i in unk_s if bin(candidates[i]).count('1') <= max_k
+            ]
+            # check every subset of those spaces
+            for subset in subsets(len(small), max_k):
+                set_nums = 0
+                # Get all constraint values for subset
+                for j in subset:
+                    set_nums |= candidates[small[j]]
+                # If #subset == #constraints then subset is naked set
+                # Remove constraints from inverse set members' futures
+                if bin(set_nums).count('1') == len(subset) < len(unk_s):
+                    naked = [small[j] for j in subset]
+                    for i in unk_s:
+                        if i not in naked and candidates[i] & set_nums:
+                            candidates[i] &= ~set_nums
+                            if candidates[i] == 0:
+                                self.conflict = True
+                            self.mod_q.put(i)
+        self.candidates[:] = candidates
 
     def is_solved(self) -> bool:
         '''
         Checks is board is solved without conflicts
         '''
-        s: Space
         if not self.mod_q.empty(): return False
-        for s in self.spaces.values():
-            if s.value is None:
-                return False
-        if self.has_conflict(): return False
-        return True
+        if np.any(self.values == BLANK): return False
+        if not np.array_equal(self.values[self.givens], self.given_values):
+            return False
+        # Every block, row, col must hold every value exactly once
+        seen = np.bitwise_or.reduce(self.value_masks(), axis=1)
+        return bool(np.all(seen == (1 << self.n**2) - 1))
 
     def has_conflict(self) -> bool:
         '''
         Checks for conflicts
         '''
-        s: Space
-        for s in self.spaces.values():
-            if s.value is None and len(s.futures) == 0:
-                return True
-        for s in self.spaces.values():
-            if s.value is not None:
-                n: Space
-                for n in s.neighbors:
-                    if s.value == n.value:
-                        return True
-        return False
+        if np.any((self.values == BLANK) & (self.candidates == 0)):
+            return True
+        # Summing a group's value bits only matches OR-ing them if no value
+        # is repeated
+        masks = self.value_masks()
+        return bool(np.any(
+            masks.sum(axis=1) != np.bitwise_or.reduce(masks, axis=1)))
 
-    def get_state(self) -> List[int]:
+    def value_masks(self) -> np.ndarray:
         '''
-        Returns the current board state as a list
+        Returns the value of each space as a bitmask (0 if BLANK),
+        one row per block, row, col.
         '''
-        return [s.value for s in self.spaces.values()]
+        return (np.uint32(1) << self.values[self.groups]) >> 1
 
-    def clone(self) -> object:
+    def get_state(self) -> List[int]:
         '''
-        Creates a clone of the board
+        Returns the current board state as a list
         '''
-        return Sudoku(self.get_state(), self.n)
+        return [
+            None if v == BLANK else v + self.low - 1
+            for v in self.values.tolist()
+        ]
 
     def print(self) -> None:
         '''
@@ -275,13 +410,14 @@ class Sudoku:
         10, 11, ... -> 'A, B, ...'
         '''
         n = self.n
-        for i in range(len(self.spaces)):
-            if self.spaces[i].value is None:
+        state = self.get_state()
+        for i in range(len(state)):
+            if state[i] is None:
                 print_val = ' '
-            elif self.spaces[i].value < 10:
-                print_val = self.spaces[i].value
+            elif state[i] < 10:
+                print_val = state[i]
             else:
-                print_val = chr(self.spaces[i].value + 55)
+                print_val = chr(state[i] + 55)
             if i % ((n**2) * n) == 0:
                 for _ in range(n):
                     print(' ', end='')
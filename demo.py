@@ -75,14 +75,20 @@ if __name__ == "__main__":
 
     # Setup multiprocessing pool and run
     print('Solving Puzzles...')
-    pool = get_context("spawn").Pool()
+    # fork avoids re-importing pandas/numpy in every worker (POSIX only)
+    ctx = get_context("fork" if os.name != 'nt' else "spawn")
+    procs = os.cpu_count() or 1
+    pool = ctx.Pool(processes=procs)
     pool_args = []
     for i, r in data.iterrows():
         pool_args.append([i, r['parsed']])
     data.drop(columns=['parsed'], inplace=True)
     t = time_ns()
     res = list(
-        tqdm.tqdm(pool.imap(run_puzzle, pool_args, chunksize=1),
+        tqdm.tqdm(pool.imap_unordered(run_puzzle,
+                                      pool_args,
+                                      chunksize=max(
+                                          1, len(pool_args) // (4 * procs))),
                   total=len(pool_args)))
     pool.close()
     pool.join()